@@ -14,11 +14,24 @@ __all__ = (
 __version__ = '2.0.2'
 
 
-from functools import total_ordering as _total_ordering
+from functools import lru_cache as _lru_cache
+import re as _re
 
 
 _HEX_DIGITS = "0123456789ABCDEFabcdef"
 
+# Looking up ``from_bytes`` on ``int`` makes a new bound method
+# every time, which costs more than the actual conversion does
+# for address-sized byte strings, so it is only done once here:
+_int_from_bytes = int.from_bytes
+
+# ``bytes.hex`` only takes a separator since Python 3.8,
+# and older Pythons have to format addresses without it:
+try:
+    _BYTES_HEX_TAKES_SEPARATOR = (b'\0\0'.hex('-') == '00-00')
+except (AttributeError, TypeError):
+    _BYTES_HEX_TAKES_SEPARATOR = False
+
 
 def _name(obj):
     return type(obj).__name__
@@ -46,7 +59,6 @@ def _value_error(value, error, *classes):
     return ValueError(repr(value) + ' ' + error + ' ' + class_names)
 
 
-@_total_ordering
 class HWAddress:
     """Base class for hardware addresses.
 
@@ -88,62 +100,63 @@ class HWAddress:
                 but does not match the size, or if ``address`` is an
                 integer with a value that is negative or too big.
         """
-        if isinstance(address, int):
-            overflow = 1 << type(self).size
-            if address >= overflow:
-                raise _value_error(address, 'is too big for', type(self))
+        cls = type(self)
+        kind = type(address)
+        # Exact type checks are cheaper than ``isinstance``, so the
+        # common types are checked that way before any subclasses:
+        if kind is not int and kind is not bytes and kind is not str:
+            if isinstance(address, int):
+                kind = int
+            elif isinstance(address, bytes):
+                kind = bytes
+            elif isinstance(address, str):
+                kind = str
+        if kind is int:
+            if address >= 1 << cls.size:
+                raise _value_error(address, 'is too big for', cls)
             if address < 0:
                 raise ValueError('hardware address cannot be negative')
             self._address = address
-        elif isinstance(address, bytes):
-            length = len(address)
-            size_in_bytes = (type(self).size + 7) >> 3
-            if length != size_in_bytes:
-                raise _value_error(address, 'has wrong length for', type(self))
-            offset = (8 - type(self).size) & 7
-            self._address = int.from_bytes(address, 'big') >> offset
-        elif isinstance(address, str) and len(type(self).formats):
-            self._address, _ = _parse(address, type(self))
+        elif kind is bytes:
+            size = cls.size
+            if len(address) != (size + 7) >> 3:
+                raise _value_error(address, 'has wrong length for', cls)
+            offset = (8 - size) & 7
+            self._address = _int_from_bytes(address, 'big') >> offset
+        elif kind is str and len(cls.formats):
+            self._address, _ = _parse(address, (cls,))
         # Subclass being "cast" to superclass:
-        elif isinstance(address, type(self)):
+        elif isinstance(address, cls):
             self._address = int(address)
         # Superclass being "cast" to subclass:
         elif (isinstance(address, HWAddress)
         and   isinstance(self, type(address))):
             self._address = int(address)
         else:
-            raise _type_error(address, type(self))
+            raise _type_error(address, cls)
 
     def __repr__(self):
         """Represent the hardware address as an unambiguous string."""
         try:
             address = repr(str(self))
         except TypeError:
-            address = _hex(int(self), type(self).size)
+            address = _hex(self._address, type(self).size)
         return _name(self) + '(' + address + ')'
 
     def __str__(self):
         """Get the canonical human-readable string of this hardware address."""
-        formats = type(self).formats
+        cls = type(self)
+        formats = cls.formats
         if not len(formats):
             raise TypeError(_name(self) + ' has no string format')
-        result = []
-        offset = (4 - type(self).size) & 3
-        unconsumed_address_value = int(self) << offset
-        for character in reversed(formats[0]):
-            if character == 'x':
-                nibble = unconsumed_address_value & 0xf
-                result.append(_HEX_DIGITS[nibble])
-                unconsumed_address_value >>= 4
-            else:
-                result.append(character)
-        return ''.join(reversed(result))
+        offset = (4 - cls.size) & 3
+        return _formatter(formats[0])(self._address << offset)
 
     def __bytes__(self):
         """Get the big-endian byte string of this hardware address."""
-        offset = (8 - type(self).size) & 7
-        size_in_bytes = (type(self).size + 7) >> 3
-        return (int(self) << offset).to_bytes(size_in_bytes, 'big')
+        size = type(self).size
+        address = self._address << ((8 - size) & 7)
+        return address.to_bytes((size + 7) >> 3, 'big')
 
     def __int__(self):
         """Get the raw integer value of this hardware address."""
@@ -157,7 +170,7 @@ class HWAddress:
         """
         if not isinstance(other, HWAddress):
             return NotImplemented
-        return type(self) == type(other) and int(self) == int(other)
+        return type(self) is type(other) and self._address == other._address
 
     def __lt__(self, other):
         """Check if this hardware address is before another.
@@ -178,17 +191,43 @@ class HWAddress:
         class2 = type(other)
         size1 = class1.size
         size2 = class2.size
-        bits1 = int(self)
-        bits2 = int(other)
+        bits1 = self._address
+        bits2 = other._address
         if size1 > size2:
             bits2 <<= size1 - size2
         else:
             bits1 <<= size2 - size1
-        return (bits1, size1, id(class1)) < (bits2, size2, id(class2))
+        # Same as comparing (bits, size, id(class)) tuples, but
+        # without building two tuples for every comparison:
+        if bits1 != bits2:
+            return bits1 < bits2
+        if size1 != size2:
+            return size1 < size2
+        return id(class1) < id(class2)
+
+    # The order is total, so the other comparisons are all just
+    # ``__lt__`` with the addresses swapped, negated, or both:
+    def __le__(self, other):
+        """Check if this hardware address is before or equal to another."""
+        if not isinstance(other, HWAddress):
+            return NotImplemented
+        return not HWAddress.__lt__(other, self)
+
+    def __gt__(self, other):
+        """Check if this hardware address is after another."""
+        if not isinstance(other, HWAddress):
+            return NotImplemented
+        return HWAddress.__lt__(other, self)
+
+    def __ge__(self, other):
+        """Check if this hardware address is after or equal to another."""
+        if not isinstance(other, HWAddress):
+            return NotImplemented
+        return not HWAddress.__lt__(self, other)
 
     def __hash__(self):
         """Get the hash of this hardware address."""
-        return hash((type(self), int(self)))
+        return hash((type(self), self._address))
 
 
 def _hex(integer, bits):
@@ -202,6 +241,80 @@ def _hex(integer, bits):
     return '0x' + hex((1 << (bits+3)) | integer)[3:]
 
 
+@_lru_cache(maxsize=1024)
+def _formatter(format_):
+    # Compile a format string into a function which takes an
+    # integer and returns it formatted as that format string.
+    #
+    # Formats which are just equal groups of whole bytes split
+    # by a separator character (or not split at all) can use
+    # ``bytes.hex`` to do all the work, as long as uppercasing
+    # its output does not change the separator too. Formats
+    # which separate every single digit can just join the
+    # digits together. Other formats get all the hex digits
+    # with one ``%``, and splice each run of them between the
+    # literal characters with another.
+    #
+    # Examples:
+    #     ('xx-xx') ->
+    #         def formatter(value):
+    #             return (value & 65535).to_bytes(2, "big").hex('-', 1).upper()
+    #     ('x.x.x') ->
+    #         def formatter(value):
+    #             return '.'.join('%03X' % (value & 4095))
+    #     ('x.xxx') ->
+    #         def formatter(value):
+    #             digits = '%04X' % (value & 65535)
+    #             return '%s.%s' % (digits[0:1], digits[1:4], )
+    runs = _re.findall('x+|[^x]+', format_)
+    groups = set(runs[0::2])
+    separators = set(runs[1::2])
+    separator = ''.join(separators)
+    digits = format_.count('x')
+    mask = (1 << (digits * 4)) - 1
+    hexadecimal = '%0' + str(digits) + 'X'
+    evenly_separated = (
+        len(runs) & 1 and len(groups) == 1 and len(separators) < 2
+        and runs[0][0] == 'x'
+    )
+    if (_BYTES_HEX_TAKES_SEPARATOR
+    and evenly_separated and not len(runs[0]) & 1
+    and len(separator) < 2 and separator < '\x80'
+    and separator == separator.upper()):
+        if separator:
+            arguments = repr(separator) + ', ' + str(len(runs[0]) >> 1)
+        else:
+            arguments = ''
+        source = (
+            'def formatter(value):\n'
+            '    return (value & %d).to_bytes(%d, "big").hex(%s).upper()\n'
+        ) % (mask, digits >> 1, arguments)
+    elif evenly_separated and runs[0] == 'x':
+        source = (
+            'def formatter(value):\n'
+            '    return %r.join(%r %% (value & %d))\n'
+        ) % (separator, hexadecimal, mask)
+    else:
+        template = ''
+        slices = ''
+        start = 0
+        for run in runs:
+            if run[0] == 'x':
+                template += '%s'
+                slices += 'digits[%d:%d], ' % (start, start + len(run))
+                start += len(run)
+            else:
+                template += run.replace('%', '%%')
+        source = (
+            'def formatter(value):\n'
+            '    digits = %r %% (value & %d)\n'
+            '    return %r %% (%s)\n'
+        ) % (hexadecimal, mask, template, slices)
+    namespace = {}
+    exec(source, namespace)
+    return namespace['formatter']
+
+
 class OUI(HWAddress):
     """Organizationally Unique Identifier."""
 
@@ -221,8 +334,21 @@ class _StartsWithOUI(HWAddress):
 
     @property
     def oui(self):
-        """Get the OUI part of this hardware address."""
-        return OUI(int(self) >> (type(self).size - OUI.size))
+        """Get the OUI part of this hardware address.
+
+        Since hardware address objects are immutable, the same
+        ``OUI`` object may be returned for many addresses.
+        """
+        return _oui(self._address >> (type(self).size - OUI.size))
+
+
+@_lru_cache(maxsize=4096)
+def _oui(address):
+    # Code which groups or sorts many addresses by their OUIs
+    # tends to ask for the same few OUIs over and over, so it
+    # is worth reusing them instead of making a new one each
+    # time.
+    return OUI(address)
 
 
 class CDI32(_StartsWithOUI):
@@ -342,13 +468,12 @@ def parse(value, *classes):
     if not classes:
         raise TypeError('parse() requires at least one class argument')
     if isinstance(value, str):
-        address, cls = _parse(value, *classes)
+        address, cls = _parse(value, classes)
         return cls(address)
     elif isinstance(value, bytes):
-        max_size = len(value) * 8
-        min_size = max_size - 7
+        length = len(value)
         for cls in classes:
-            if min_size <= cls.size <= max_size:
+            if (cls.size + 7) >> 3 == length:
                 return cls(value)
         raise _value_error(value, 'has wrong length for', *classes)
     elif isinstance(value, classes):
@@ -356,34 +481,77 @@ def parse(value, *classes):
     raise _type_error(value, *classes)
 
 
-def _parse(string, *classes):
+def _parse(string, classes):
     length = len(string)
     if length < 1:
         raise ValueError('hardware address cannot be an empty string')
-    candidates = {}
-    for cls in classes:
-        for format_ in cls.formats:
-            if len(format_) == length:
-                candidates.setdefault(format_, cls)
-    candidates = sorted(candidates.items())
-    address = 0
-    start = 0
-    end = len(candidates)
-    for index in range(length):
-        character = string[index]
-        if character in _HEX_DIGITS:
-            address <<= 4
-            address += int(character, 16)
-            character = 'x'
-        elif character == 'x':
-            character = ''
-        while start < end and candidates[start][0][index] < character:
-            start += 1
-        while start < end and candidates[end - 1][0][index] > character:
-            end -= 1
-        if start >= end:
-            raise _value_error(string, 'cannot be parsed as', *classes)
-    _, cls = candidates[start]
-    offset = (4 - cls.size) & 3
-    address >>= offset
+    try:
+        parsers = _parsers(tuple([cls.formats for cls in classes]))
+    except TypeError:
+        # Formats can be any sequence, but only tuples are hashable:
+        parsers = _parsers(tuple([tuple(cls.formats) for cls in classes]))
+    parser = parsers.get(length)
+    if parser is None:
+        raise _value_error(string, 'cannot be parsed as', *classes)
+    pattern, owners = parser
+    # Every alternative matches exactly as many characters as its
+    # format has, which is the length of the string, so a match at
+    # the start is a full match (and works before Python 3.4 too):
+    match = pattern.match(string)
+    if match is None:
+        raise _value_error(string, 'cannot be parsed as', *classes)
+    index, literals = owners[match.lastindex - 1]
+    cls = classes[index]
+    for literal in literals:
+        string = string.replace(literal, '')
+    address = int(string or '0', 16)
+    address >>= (4 - cls.size) & 3
     return address, cls
+
+
+@_lru_cache(maxsize=1024)
+def _parsers(formats):
+    # Compile the formats of several classes into a dictionary
+    # which maps each string length to a regular expression that
+    # matches any of the formats of that length, with one group
+    # per distinct format, and a tuple which maps each group to
+    # the index of the first class with that format and a tuple
+    # of the distinct literal characters in that format, which
+    # are removed before the digits are converted to an integer.
+    # A string of any other length is rejected without a regex.
+    #
+    # Each "x" matches one hexadecimal digit. Everything else
+    # is literal, except that a hexadecimal digit in a format
+    # never matches (because input digits always count as an
+    # "x"), and a literal "x" in the input never matches either.
+    #
+    # Example, where each H stands for '[0123456789ABCDEFabcdef]':
+    #     (('xx-xx', 'xxxx', 'xx:xx'), ('xx-xx',)) -> {
+    #         5: (re.compile('(HH\\-HH)|(HH:HH)'), ((0, ('-',)), (0, (':',)))),
+    #         4: (re.compile('(HHHH)'), ((0, ()),)),
+    #     }
+    alternatives = {}
+    owners = {}
+    seen = set()
+    for index, class_formats in enumerate(formats):
+        for format_ in class_formats:
+            if format_ in seen:
+                continue
+            seen.add(format_)
+            regex = ''
+            for character in format_:
+                if character == 'x':
+                    regex += '[' + _HEX_DIGITS + ']'
+                elif character in _HEX_DIGITS:
+                    regex += '(?!)'
+                else:
+                    regex += _re.escape(character)
+            literals = tuple(sorted(set(format_) - {'x'}))
+            length = len(format_)
+            alternatives.setdefault(length, []).append('(' + regex + ')')
+            owners.setdefault(length, []).append((index, literals))
+    parsers = {}
+    for length in alternatives:
+        pattern = _re.compile('|'.join(alternatives[length]))
+        parsers[length] = (pattern, tuple(owners[length]))
+    return parsers
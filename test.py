@@ -1,24 +1,32 @@
+import functools
+import os
+import pickle
+import subprocess
+import sys
 import weakref
 
-from hypothesis import given
+from hypothesis import HealthCheck, example, given, settings
 from hypothesis.strategies import (
     binary,
     booleans,
     characters,
     composite,
-    from_regex,
     integers,
     lists,
     one_of,
     sampled_from,
     text,
 )
-import reprshed
 import pytest
 
 from macaddress import *
 
 
+# For tests whose examples each build several classes or do a lot
+# of work per format, so that the time per example varies a lot:
+_slow = settings(deadline=None, suppress_health_check=[HealthCheck.too_slow])
+
+
 @composite
 def _addresses(draw, random_formats=0):
     Class = draw(_address_classes(random_formats))
@@ -35,107 +43,210 @@ def _addresses_with_several_random_formats(draw):
 @composite
 def _address_classes_and_invalid_integers(draw):
     Class = draw(_address_classes())
-    invalid_integer = draw(one_of(
-        integers(max_value=-1),
-        integers(min_value=(1 << Class.size)),
-    ))
+    invalid_integer = draw(_invalid_integers(Class.size))
     return (Class, invalid_integer)
 
 
 @composite
 def _address_classes_and_invalid_bytes(draw):
     Class = draw(_address_classes())
-    size_in_bytes = (Class.size + 7) >> 3
-    invalid_byte_string = draw(one_of(
-        binary(max_size=size_in_bytes-1),
-        binary(min_size=size_in_bytes+1),
-    ))
+    invalid_byte_string = draw(_invalid_byte_strings(Class._size_bytes))
     return (Class, invalid_byte_string)
 
 
 @composite
 def _address_classes_and_invalid_strings(draw):
     Class = draw(_address_classes())
-    size_in_nibbles = (Class.size + 3) >> 2
-    invalid_string = draw(one_of(
+    invalid_string = draw(_invalid_strings(Class._size_nibbles))
+    return (Class, invalid_string)
+
+
+# Strategies are immutable, so the ones which only depend on
+# the size are made once per size instead of once per draw:
+@functools.lru_cache(maxsize=128)
+def _invalid_integers(size_in_bits):
+    return one_of(
+        integers(max_value=-1),
+        integers(min_value=(1 << size_in_bits)),
+    )
+
+
+@functools.lru_cache(maxsize=128)
+def _invalid_byte_strings(size_in_bytes):
+    return one_of(
+        binary(max_size=size_in_bytes-1),
+        binary(min_size=size_in_bytes+1),
+    )
+
+
+_hex_characters = sampled_from('0123456789ABCDEFabcdef')
+_non_hex_characters = characters(exclude_characters='0123456789ABCDEFabcdef')
+
+
+@functools.lru_cache(maxsize=128)
+def _invalid_strings(size_in_nibbles):
+    return one_of(
         text(characters(), max_size=size_in_nibbles-1),
         text(characters(), min_size=size_in_nibbles+1),
-        from_regex('[^0-9A-Fa-f]'),
+        text(_non_hex_characters, min_size=1, max_size=size_in_nibbles),
+        _strings_with_a_non_hex_character(size_in_nibbles),
+    )
+
+
+@composite
+def _strings_with_a_non_hex_character(draw, size_in_nibbles):
+    # Either valid digits around one bad character, which only
+    # the regex can reject because the length is right, or any
+    # other string around one:
+    string = draw(one_of(
+        text(
+            _hex_characters,
+            min_size=size_in_nibbles-1,
+            max_size=size_in_nibbles-1,
+        ),
+        text(characters()),
     ))
-    return (Class, invalid_string)
+    index = draw(integers(min_value=0, max_value=len(string)))
+    character = draw(_non_hex_characters)
+    return string[:index] + character + string[index:]
 
 
 @composite
 def _lists_of_distinctly_formatted_addresses(draw):
-    return draw(lists(
-        _addresses(random_formats=1),
+    # Drawing distinct formats first, instead of drawing addresses
+    # and rejecting the ones with a format that was already drawn,
+    # avoids making classes for addresses that get thrown away:
+    format_strings = draw(lists(
+        integers(min_value=1, max_value=16).flatmap(_address_format_strings),
         min_size=2,
         max_size=8,
-        unique_by=lambda address: address.formats[0],
+        unique=True,
     ))
+    addresses = []
+    for format_string in format_strings:
+        size_in_nibbles = format_string.count('x')
+        size_in_bits = draw(integers(
+            min_value=(size_in_nibbles * 4) - 3,
+            max_value=(size_in_nibbles * 4),
+        ))
+        addresses.append(draw(_address_of_shape(size_in_bits, format_string)))
+    return addresses
 
 
 @composite
 def _lists_of_distinctly_sized_addresses(draw):
-    return draw(lists(
-        _addresses(),
+    # Same idea as distinctly formatted addresses above, but with
+    # distinct sizes in bytes, since that is what has to differ:
+    sizes_in_bytes = draw(lists(
+        integers(min_value=1, max_value=8),
         min_size=2,
         max_size=8,
-        unique_by=lambda address: (address.size + 7) >> 3,
+        unique=True,
     ))
+    addresses = []
+    for size_in_bytes in sizes_in_bytes:
+        size_in_bits = draw(integers(
+            min_value=(size_in_bytes * 8) - 7,
+            max_value=(size_in_bytes * 8),
+        ))
+        format_string = 'x' * ((size_in_bits + 3) >> 2)
+        addresses.append(draw(_address_of_shape(size_in_bits, format_string)))
+    return addresses
+
+
+@composite
+def _address_of_shape(draw, size_in_bits, format_string):
+    class_should_be_slotted = draw(booleans())
+    Class = _build_class(
+        size_in_bits,
+        (format_string,),
+        class_should_be_slotted,
+    )
+    address_as_an_integer = draw(_address_integers(size_in_bits))
+    return Class(address_as_an_integer)
+
+
+@composite
+def _addresses_with_oui(draw):
+    Class = draw(sampled_from((CDI32, CDI40, EUI48, EUI60, EUI64)))
+    address_as_an_integer = draw(_address_integers(Class.size))
+    return Class(address_as_an_integer)
+
+
+# The sizes right around nibble and byte boundaries, and the sizes
+# of the provided classes, are the most interesting ones, and drawing
+# them often also means more reuse of already built classes, but any
+# other size up to 64 bits can still be drawn too:
+_address_sizes = one_of(
+    sampled_from((1, 2, 3, 4, 7, 8, 9, 15, 16, 24, 32, 40, 48, 60, 64)),
+    integers(min_value=1, max_value=64),
+)
 
 
 @composite
 def _address_classes(draw, random_formats=0):
-    address_sizes = integers(min_value=1, max_value=64)
-    size_in_bits = draw(address_sizes)
+    size_in_bits = draw(_address_sizes)
     size_in_nibbles = (size_in_bits + 3) >> 2
 
     if random_formats > 0:
-        format_strings = draw(lists(
+        format_strings = tuple(draw(lists(
             _address_format_strings(size_in_nibbles),
             min_size=random_formats,
             max_size=random_formats,
-        ))
+        )))
     else:
         format_string = 'x' * size_in_nibbles
         format_strings = (format_string,)
 
     class_should_be_slotted = draw(booleans())
 
+    return _build_class(size_in_bits, format_strings, class_should_be_slotted)
+
+
+# Hypothesis draws the same few shapes of class over and over, and
+# making a class is far more expensive than anything the tests do
+# with it, so each one is only made once. Tests which temporarily
+# change a class must put it back the way it was before returning.
+@functools.lru_cache(maxsize=4096)
+def _build_class(size_in_bits, format_strings, class_should_be_slotted):
     class Class(HWAddress):
         if class_should_be_slotted:
             __slots__ = ()
         size = size_in_bits
         formats = format_strings
+        _size_bytes = (size_in_bits + 7) >> 3
+        _size_nibbles = (size_in_bits + 3) >> 2
         def __repr__(self):
-            return reprshed.impure(
-                self,
-                size=type(self).size,
-                formats=type(self).formats,
-                slots=class_should_be_slotted,
-                address=self._address,
+            return (
+                f'<{type(self).__name__}'
+                f' size={type(self).size!r}'
+                f' formats={type(self).formats!r}'
+                f' slots={class_should_be_slotted!r}'
+                f' address={self._address!r}>'
             )
 
     return Class
 
 
+@functools.lru_cache(maxsize=128)
 def _address_integers(size_in_bits):
     return integers(min_value=0, max_value=((1 << size_in_bits) - 1))
 
 
-_address_format_characters = sampled_from('x-:.')
+# A letter is included because letters, unlike the other separators,
+# could be changed by uppercasing the digits around them:
+_address_format_separator_runs = text(sampled_from(('-', ':', '.', 'g')))
 
 
 @composite
 def _address_format_strings(draw, size_in_nibbles):
-    characters = []
-    while size_in_nibbles:
-        character = draw(_address_format_characters)
-        if character == 'x':
-            size_in_nibbles -= 1
-        characters.append(character)
-    return ''.join(characters)
+    # One run of separators before, between, and after each "x":
+    separators = draw(lists(
+        _address_format_separator_runs,
+        min_size=size_in_nibbles+1,
+        max_size=size_in_nibbles+1,
+    ))
+    return separators[0] + ''.join('x' + run for run in separators[1:])
 
 
 @given(_addresses())
@@ -165,11 +276,23 @@ def test_bytes_value_error(Class_and_bytes):
 
 
 @given(_addresses(random_formats=1))
+# Random formats rarely group whole bytes with the same letter between
+# each group, so one which does is always tried:
+@example(_build_class(16, ('xxgxx',), True)(0xABCD))
 def test_str(address):
     Class = type(address)
     assert Class(str(address)) == address
 
 
+@given(_addresses(random_formats=1))
+def test_str_formats_list(address):
+    class ListClass(HWAddress):
+        size = address.size
+        formats = list(address.formats)
+    assert int(ListClass(str(address))) == int(address)
+    assert parse(str(address), ListClass) == ListClass(int(address))
+
+
 @given(_address_classes_and_invalid_strings())
 def test_str_value_error(Class_and_string):
     Class, string = Class_and_string
@@ -179,28 +302,48 @@ def test_str_value_error(Class_and_string):
 
 @given(_address_classes())
 def test_str_x_literal_value_error(Class):
-    size_in_nibbles = (Class.size + 3) >> 2
+    size_in_nibbles = Class._size_nibbles
     with pytest.raises(ValueError):
         Class('x' * size_in_nibbles)
 
 
+@_slow
 @given(_addresses_with_several_random_formats())
 def test_str_alternatives(address):
     Class = type(address)
-    formats = Class.formats
-    for format in formats:
-        # Override instance formats to make this format the only
-        # format, because it will stringify using the first one.
-        Class.formats = (format,)
+    for format in Class.formats:
+        # Make a class of the same size with this format as the
+        # only format, because it will stringify using the first
+        # one, instead of changing the formats of the class itself:
+        FormatClass = _build_class(Class.size, (format,), True)
         # Format to string using the newly chosen format:
-        formatted = str(address)
-        # Restore the original formats for comparison, so that
-        # the test verifies that the constructor parses each
-        # alternate format whether or not it is the first one:
-        Class.formats = formats
+        formatted = str(FormatClass(int(address)))
+        # The original class is used for comparison, so that the
+        # test verifies that the constructor parses each alternate
+        # format whether or not it is the first one:
         assert Class(formatted) == address
 
 
+@given(_addresses(random_formats=1))
+def test_size_assigned_after_class_creation(address):
+    Class = type(address)
+    class LateClass(HWAddress):
+        formats = Class.formats
+    LateClass.size = Class.size
+    class ResizedClass(HWAddress):
+        size = Class.size + 1
+        formats = Class.formats
+    ResizedClass.size = Class.size
+    for OtherClass in LateClass, ResizedClass:
+        other_address = OtherClass(int(address))
+        assert int(OtherClass(bytes(address))) == int(address)
+        assert int(OtherClass(str(address))) == int(address)
+        assert bytes(other_address) == bytes(address)
+        assert str(other_address) == str(address)
+        with pytest.raises(ValueError):
+            OtherClass(1 << Class.size)
+
+
 @given(_addresses())
 def test_copy_construction(address):
     Class = type(address)
@@ -228,6 +371,7 @@ def test_parse_str(address):
     assert parse(str(address), Class) == address
 
 
+@_slow
 @given(_lists_of_distinctly_formatted_addresses())
 def test_parse_str_alternatives(addresses):
     classes = [type(address) for address in addresses]
@@ -241,6 +385,7 @@ def test_parse_bytes(address):
     assert parse(bytes(address), Class) == address
 
 
+@_slow
 @given(_lists_of_distinctly_sized_addresses())
 def test_parse_bytes_alternatives(addresses):
     classes = [type(address) for address in addresses]
@@ -254,34 +399,35 @@ def test_parse_passthrough(address):
     assert parse(address, Class) == address
 
 
+@given(_addresses_with_oui())
+def test_oui(address):
+    assert address.oui == OUI(bytes(address)[:3])
+
+
 @given(_addresses(), _addresses())
 def test_equality(address1, address2):
-    assert (address1 == address2) == (_key(address1) == _key(address2))
-    assert (address1 != address2) == (_key(address1) != _key(address2))
+    key1 = _key(address1)
+    key2 = _key(address2)
+    assert (address1 == address2) == (key1 == key2)
+    assert (address1 != address2) == (key1 != key2)
 
 
 @given(_addresses(), _addresses())
 def test_ordering(address1, address2):
-    assert (address1 <  address2) == (_key(address1) <  _key(address2))
-    assert (address1 <= address2) == (_key(address1) <= _key(address2))
-    assert (address1 >  address2) == (_key(address1) >  _key(address2))
-    assert (address1 >= address2) == (_key(address1) >= _key(address2))
+    key1 = _key(address1)
+    key2 = _key(address2)
+    assert (address1 <  address2) == (key1 <  key2)
+    assert (address1 <= address2) == (key1 <= key2)
+    assert (address1 >  address2) == (key1 >  key2)
+    assert (address1 >= address2) == (key1 >= key2)
 
 
 def _key(address):
-    return (_bits(address), id(type(address)))
+    return (_bits(int(address), address.size), id(type(address)))
 
 
-def _bits(address):
-    size = address.size
-    address = int(address)
-    bits = []
-    while size:
-        least_significant_bit = address & 1
-        bits.append(least_significant_bit)
-        address >>= 1
-        size -= 1
-    return ''.join(map(str, reversed(bits)))
+def _bits(integer, size):
+    return format(integer, '0{}b'.format(size))
 
 
 @given(_addresses(), _addresses())
@@ -307,29 +453,70 @@ def test_hash(address1, address2):
         assert hash(address1) == hash(address2)
 
 
+@pytest.mark.parametrize('Class, integer', [
+    (OUI, 0x010203),
+    (MAC, 0x010203040506),
+    (EUI64, 0x0102030405060708),
+])
+def test_hash_after_pickle_in_another_process(Class, integer):
+    # Hashes of classes are different in each process, so an
+    # address pickled by another process has to hash the same
+    # as one made in this process for sets and dicts to work:
+    script = (
+        'import pickle, sys, macaddress\n'
+        'address = macaddress.%s(%d)\n'
+        'hash(address)\n'
+        'sys.stdout.buffer.write(pickle.dumps((address, {address})))\n'
+    ) % (Class.__name__, integer)
+    output = subprocess.run(
+        [sys.executable, '-c', script],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.PIPE,
+        check=True,
+    ).stdout
+    address, addresses = pickle.loads(output)
+    assert address == Class(integer)
+    assert hash(address) == hash(Class(integer))
+    assert Class(integer) in addresses
+
+
 @given(_addresses())
 def test_repr(address):
     Class = type(address)
+    __repr__ = Class.__repr__
     del Class.__repr__
-    assert eval(repr(address)) == address
+    try:
+        assert eval(repr(address)) == address
+    finally:
+        Class.__repr__ = __repr__
 
 
 @given(_addresses())
 def test_repr_no_formats(address):
     Class = type(address)
+    __repr__ = Class.__repr__
+    formats = Class.formats
     del Class.__repr__
     del Class.formats
-    assert eval(repr(address)) == address
+    try:
+        assert eval(repr(address)) == address
+    finally:
+        Class.__repr__ = __repr__
+        Class.formats = formats
 
 
 @given(_addresses())
 def test_str_no_formats(address):
     Class = type(address)
+    formats = Class.formats
     del Class.formats
-    with pytest.raises(TypeError):
-        str(address)
-    with pytest.raises(TypeError):
-        Class("")
+    try:
+        with pytest.raises(TypeError):
+            str(address)
+        with pytest.raises(TypeError):
+            Class("")
+    finally:
+        Class.formats = formats
 
 
 @given(_addresses())
@@ -337,22 +524,33 @@ def test_weak_reference(address):
     weakref.ref(address)
 
 
-def test_type_errors():
-    class Dummy:
-        pass
-    for thing in (None, [], {}, object, object(), Dummy, Dummy()):
-        with pytest.raises(TypeError):
-            MAC(thing)
-        with pytest.raises(TypeError):
-            parse(thing, MAC, OUI)
-        with pytest.raises(TypeError):
-            parse(thing)
+class _Dummy:
+    pass
+
+
+_wrong_type_things = (None, [], {}, object, object(), _Dummy, _Dummy())
+
+
+@pytest.mark.parametrize('thing', _wrong_type_things)
+def test_type_error(thing):
+    with pytest.raises(TypeError):
+        MAC(thing)
+
+
+@pytest.mark.parametrize('thing', _wrong_type_things)
+def test_parse_type_error(thing):
+    with pytest.raises(TypeError):
+        parse(thing, MAC, OUI)
+
+
+@pytest.mark.parametrize('thing', _wrong_type_things)
+def test_parse_no_classes_type_error(thing):
+    with pytest.raises(TypeError):
+        parse(thing)
 
 
 def test_equality_not_implemented():
-    class Dummy:
-        pass
-    for thing in (None, [], {}, object, object(), Dummy, Dummy()):
+    for thing in _wrong_type_things:
         assert MAC(0).__eq__(thing) is NotImplemented
         assert MAC(0).__ne__(thing) is NotImplemented
 
@@ -360,4 +558,23 @@ def test_equality_not_implemented():
 def test_provided_classes():
     for Class in OUI, CDI32, CDI40, MAC, EUI48, EUI60, EUI64:
         for format in Class.formats:
-            assert (Class.size + 3) >> 2 == sum(1 for x in format if x == 'x')
+            assert (Class.size + 3) >> 2 == format.count('x')
+
+
+_provided_class_samples = [
+    (Class, integer & ((1 << Class.size) - 1))
+    for Class in (OUI, CDI32, CDI40, EUI48, EUI60, EUI64)
+    for integer in (0, 1, 0x0123456789ABCDEF, -1)
+]
+
+
+@pytest.mark.parametrize('Class, integer', _provided_class_samples)
+def test_provided_classes_round_trip(Class, integer):
+    address = Class(integer)
+    assert int(address) == integer
+    assert Class(bytes(address)) == address
+    for format in Class.formats:
+        FormatClass = _build_class(Class.size, (format,), True)
+        assert Class(str(FormatClass(integer))) == address
+    assert Class(address) == address
+    assert hash(Class(integer)) == hash(address)